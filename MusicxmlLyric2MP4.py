@@ -17,7 +17,11 @@ import numpy as np
 from PIL import Image, ImageTk
 from PIL import ImageDraw
 from PIL import ImageFont
-from pathlib import Path
+import os
+import errno
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 root = Tk.Tk()
 root.title('Music XML Conversion Tool: Lyric to mp4')
@@ -42,89 +46,78 @@ FileEntry.grid(row=0, column=2, columnspan=10, sticky=Tk.W+Tk.E, ipadx=0, padx=0
 
 
 Lyrics=[]
-Seconds=[]
-Keyboards=[]
-Beats=[]
+Seconds=np.zeros(0)
+Keyboards=np.zeros(0, int)
+Beats=np.zeros(0)
 idxNote=0
 maxNotes=0
+# beats of each note type and semitones of each step from C
+NoteTypeBeats={'whole':4.0, 'half':2.0, 'quarter':1.0, 'eighth':0.5, '16th':0.25, '32nd':0.125, '64th':0.0625}
+StepSemitones={'C':0, 'D':2, 'E':4, 'F':5, 'G':7, 'A':9, 'B':11}
 def LoadLyric():
-    global InputFileName, fFileLoaded, Lyrics, Seconds, Keyboards, Beats, idxNote, maxNotes
+    global InputFileName, fFileLoaded, Lyrics, Seconds, Keyboards, Beats, idxNote, maxNotes, LyricImagesKey
     if(InputFileName!=''):
         if(maxNotes>0):
             maxNotes = 0
             idxNote=0
-        tree = ET.parse(InputFileName)
-        root = tree.getroot()
-        for tempo in root.iter(tag="sound"):
-            if('tempo' in tempo.attrib):
-                tempoText = "%s" % tempo.attrib
-                tempoValue = float(re.findall('[0-9]+', tempoText.split()[1])[0])
+        root = ET.parse(InputFileName).getroot()
+        Lyrics = []
+        Measures = []
+        Positions = []
+        Keyboards = []
+        Beats = []
         nMeasure = 0
         semitone = 0
-        sec = 0
-        for measure in root.iter('measure'):
-            sec = float(nMeasure) * 60.0/tempoValue*4.0
+        for measure in root.iter(tag='measure'):
+            for tempo in measure.iter(tag='sound'):
+                if('tempo' in tempo.attrib):
+                    tempoText = "%s" % tempo.attrib
+                    tempoValue = float(re.findall('[0-9]+', tempoText.split()[1])[0])
             position = 0
             for note in measure.iter(tag='note'):
-                text=note.find("lyric/text")
+                # pick up lyric, type and pitch in one walk over the children
+                text = None
+                noteType = None
+                step = None
+                alter = None
+                octave = None
+                for child in note:
+                    if(child.tag == 'lyric'):
+                        if(text == None):
+                            text = child.find('text')
+                    elif(child.tag == 'type'):
+                        noteType = child
+                    elif(child.tag == 'pitch'):
+                        for pitch in child:
+                            if(pitch.tag == 'step'):
+                                step = pitch
+                            elif(pitch.tag == 'alter'):
+                                alter = pitch
+                            elif(pitch.tag == 'octave'):
+                                octave = pitch
                 if(text!=None):
                     Lyrics.append(text.text)
                     # duration=note.find("duration")
                     Beats.append(position)
-                    noteType=note.find("type")
-                    if(noteType.text == 'whole'):
-                        position += 4
-                    elif(noteType.text == 'half'):
-                        position += 2
-                    elif(noteType.text == 'quarter'):
-                        position += 1
-                    elif(noteType.text == 'eighth'):
-                        position += 0.5
-                    elif(noteType.text == '16th'):
-                        position += 0.25
-                    elif(noteType.text == '32nd'):
-                        position += 0.125
-                    elif(noteType.text == '64th'):
-                        position += 0.0625
-                    semitone = 0
-                    step=note.find("pitch/step")
-                    if(step.text == 'D'):
-                        semitone = 2
-                    elif(step.text == 'E'):
-                        semitone = 4
-                    elif(step.text == 'F'):
-                        semitone = 5
-                    elif(step.text == 'G'):
-                        semitone = 7
-                    elif(step.text == 'A'):
-                        semitone = 9
-                    elif(step.text == 'B'):
-                        semitone = 11
-                    alter=note.find("pitch/alter")
+                    position += NoteTypeBeats.get(noteType.text, 0)
+                    semitone = StepSemitones.get(step.text, 0)
                     if(alter != None):
                         semitone += int(alter.text)
-                    octave=note.find("pitch/octave")
                     Keyboards.append(int(octave.text)*11+semitone)
-                    Seconds.append(sec+position*60.0/float(tempoValue))
+                    Measures.append(nMeasure)
+                    Positions.append(position)
                     idxNote += 1
                 else:
-                    noteType=note.find("type")
-                    if(noteType.text == 'whole'):
-                        position += 4
-                    elif(noteType.text == 'half'):
-                        position += 2
-                    elif(noteType.text == 'quarter'):
-                        position += 1
-                    elif(noteType.text == 'eighth'):
-                        position += 0.5
-                    elif(noteType.text == '16th'):
-                        position += 0.25
-                    elif(noteType.text == '32nd'):
-                        position += 0.125
-                    elif(noteType.text == '64th'):
-                        position += 0.0625
+                    position += NoteTypeBeats.get(noteType.text, 0)
             nMeasure +=1
+        # every measure is timed with the last tempo in the file
+        Measures = np.array(Measures, float)
+        Positions = np.array(Positions, float)
+        Seconds = Measures*60.0/tempoValue*4.0+Positions*60.0/tempoValue
+        Keyboards = np.array(Keyboards, int)
+        Beats = np.array(Beats)
         maxNotes=idxNote
+        LyricImagesKey = None
         fFileLoaded = 1
     
 FrameTitleLabel = Tk.Label(root, text='Frame Formats and Lyric Movements', width=30)
@@ -142,22 +135,17 @@ HeightEntry.grid(row=2, column=4, sticky=Tk.W+Tk.E, ipadx=0, padx=0)
 BGLabel = Tk.Label(root, text='Background color', width=5, justify='center')
 BGLabel.grid(row=2, column=5, columnspan=2, sticky=Tk.W+Tk.E, ipadx=0)
 def BackgroundColorChooser():
-    global backgroundRGB, Width, Height, MainCanvasSize, MainImg, backgroundRGB
+    global backgroundRGB, BlankPreviewKey
     colors=askcolor('#%02x%02x%02x' % (backgroundRGB[0],backgroundRGB[1],backgroundRGB[2]), title='Choose Background Color')
     backgroundRGB[0] = colors[0][0]
     backgroundRGB[1] = colors[0][1]
     backgroundRGB[2] = colors[0][2]
     BGColorButton.configure(bg=colors[1])
-    Width = int(WidthEntry.get())
-    Height = int(HeightEntry.get())
-    MainCanvasSize = (Width, Height)
-    MainImg = Image.new('RGBA', MainCanvasSize, tuple(backgroundRGB))
-    MainDraw = ImageDraw.Draw(MainImg)
+    UpdateFrameSettings()
+    PrepareCanvas(Width, Height, TextImageW, TextImageH, fontsize)
     MainDraw.rectangle((0,0, Width, Height), fill=tuple(backgroundRGB))
-    Disp_img = MainImg.resize((int(Width/2),int(Height/2)))
-    imgtk = ImageTk.PhotoImage(image=Disp_img)
-    ImageLabel.imgtk = imgtk
-    ImageLabel.configure(image=imgtk)
+    ShowPreview(MainImg)
+    BlankPreviewKey = (CanvasKey, tuple(backgroundRGB))
 BGColorButton=Tk.Button(root, text='Color', bg='#00FF00',  command=BackgroundColorChooser)
 BGColorButton.grid(row=2, column=7, sticky=Tk.W+Tk.E)
 
@@ -247,88 +235,143 @@ FPSEntry.grid(row=6, column=4, sticky=Tk.W+Tk.E, ipadx=0, padx=0)
 
 
 ttfontname = "c:\\Windows\\Fonts\\meiryob.ttc"
-fontsize = 72
-Width = 1280
-Height = 720
-TextImageW = 200
-TextImageH = 100
 
-MainCanvasSize = (Width, Height)
+# The frame settings are read from the entries when they are edited rather
+# than on every slider tick, which would go through Tcl for each entry.
+def UpdateFrameSettings(event=None):
+    global fontsize, Width, Height, TextImageW, TextImageH, gravity, PreviewSize
+    fontsize = int(TextSizeEntry.get())
+    Width = int(WidthEntry.get())
+    Height = int(HeightEntry.get())
+    TextImageW = int(TextWidthEntry.get())
+    TextImageH = int(TextHeightEntry.get())
+    gravity=-9.8*float(GravEntry.get())
+    PreviewSize = (Width>>1, Height>>1)
+for SettingEntry in (TextSizeEntry, WidthEntry, HeightEntry, TextWidthEntry, TextHeightEntry, GravEntry):
+    SettingEntry.bind('<FocusOut>', UpdateFrameSettings)
+    SettingEntry.bind('<Return>', UpdateFrameSettings)
+UpdateFrameSettings()
+
 backgroundRGB = [0,255,0, 255]
 textRGB = [128,128,128,255]
-MainImg = Image.new('RGBA', MainCanvasSize, tuple(backgroundRGB))
-MainDraw = ImageDraw.Draw(MainImg)
-font = ImageFont.truetype(ttfontname, fontsize)
-TextCanvasSize= (TextImageW, TextImageH)
-TextImg = Image.new('RGBA', TextCanvasSize, (255,255,255,0))
-TextDraw = ImageDraw.Draw(TextImg)
+maskBackground = (255,255,255,0)
+maskRGB= (0, 0, 0, 255)
+
+# The frame canvas and the font are shared by the preview and the MP4
+# generation. They are rebuilt only when the sizes change.
+CanvasKey = None
+def PrepareCanvas(Width, Height, TextImageW, TextImageH, fontsize):
+    global CanvasKey, MainImg, MainDraw, font
+    if(CanvasKey == (Width, Height, TextImageW, TextImageH, fontsize)):
+        return
+    CanvasKey = (Width, Height, TextImageW, TextImageH, fontsize)
+    MainCanvasSize = (Width, Height)
+    MainImg = Image.new('RGBA', MainCanvasSize, tuple(backgroundRGB))
+    MainDraw = ImageDraw.Draw(MainImg)
+    font = ImageFont.truetype(ttfontname, fontsize)
+PrepareCanvas(Width, Height, TextImageW, TextImageH, fontsize)
+
+# Each distinct lyric is rasterized once into a text image and its mask, and
+# the frames only paste them. They are rebuilt when the canvas, the colors or
+# the loaded lyrics change.
+LyricImagesKey = None
+LyricImages = []
+def PrepareLyricImages():
+    global LyricImagesKey, LyricImages
+    if(LyricImagesKey == (CanvasKey, tuple(textRGB), tuple(backgroundRGB))):
+        return
+    LyricImagesKey = (CanvasKey, tuple(textRGB), tuple(backgroundRGB))
+    TextImageW, TextImageH = CanvasKey[2:4]
+    TextCanvasSize= (TextImageW, TextImageH)
+    Images = {}
+    LyricImages = []
+    for lyric in Lyrics:
+        if(lyric not in Images):
+            TextImg = Image.new('RGBA', TextCanvasSize, tuple(backgroundRGB))
+            ImageDraw.Draw(TextImg).text((0, 0), lyric, fill=tuple(textRGB), font=font)
+            MaskImg = Image.new('RGBA', TextCanvasSize, maskBackground)
+            ImageDraw.Draw(MaskImg).text((0, 0), lyric, fill=maskRGB, font=font)
+            Images[lyric] = (TextImg, MaskImg)
+        LyricImages.append(Images[lyric])
+
+# MP4 frames are rendered by a pool of threads. The lyric images are only read,
+# but each thread draws into its own canvas, which is reused for every frame.
+# The sizes, the background and the lyric images come from a snapshot taken
+# when the generation starts, so that settings changed while rendering do not
+# leak into the frames.
+RenderThreads = os.cpu_count() or 1
+RenderLocal = threading.local()
+def RenderLyricFrame(RenderSettings, FrameLyrics):
+    FrameSizes, FrameBackground, FrameLyricImages = RenderSettings
+    Width, Height, TextImageW, TextImageH = FrameSizes
+    if(getattr(RenderLocal, 'FrameSizes', None) != FrameSizes):
+        RenderLocal.FrameSizes = FrameSizes
+        RenderLocal.MainImg = Image.new('RGBA', (Width, Height), FrameBackground)
+    MainImg = RenderLocal.MainImg
+    MainImg.paste(FrameBackground, (0, 0, Width, Height))
+    for i, X, Y in zip(*FrameLyrics):
+        TextImg, MaskImg = FrameLyricImages[i]
+        MainImg.paste(TextImg, (X, Y, X+TextImageW, Y+TextImageH), MaskImg)
+    return MainImg.tobytes()
 
 idxFrame = 0
 fps = 30
 maxSeconds = 90
-gravity=-9.8*0.2
 
 # ImageLabel = Tk.Label(root, bg='white', fg='black', borderwidth=1, relief="solid")
 ImageLabel = Tk.Label(root)
 ImageLabel.grid(row=7, column=0, columnspan=10, sticky=Tk.NW+Tk.SE)
-Disp_img = MainImg.resize((int(Width/2),int(Height/2)))
+Disp_img = MainImg.resize(PreviewSize)
 imgtk = ImageTk.PhotoImage(image=Disp_img)
 ImageLabel.imgtk = imgtk
 ImageLabel.configure(image=imgtk)
 
+# Key of the blank frame shown in the preview, None while lyrics are shown.
+# Slider ticks without any lyric in view skip redrawing the same blank frame.
+BlankPreviewKey = None
+def ShowPreview(Img):
+    Disp_img = Img.resize(PreviewSize, Image.BILINEAR)
+    imgtk = ImageLabel.imgtk
+    if((imgtk.width(), imgtk.height()) == Disp_img.size):
+        imgtk.paste(Disp_img)
+    else:
+        imgtk = ImageTk.PhotoImage(image=Disp_img)
+        ImageLabel.imgtk = imgtk
+        ImageLabel.configure(image=imgtk)
+
 CurrentFrameSec=0
 def ShowFrame(position):
     global fFileLoaded
     if(fFileLoaded==0):
         return
-    global ttfontname, Lyrics, font, backgroundRGB, textRGB, maxNotes, CurrentFrameSec
+    global Lyrics, backgroundRGB, textRGB, maxNotes, CurrentFrameSec, BlankPreviewKey
     if(float(position) <= CurrentFrameSec):
         FrameScale.set(CurrentFrameSec)
         FrameScale.update()
         return
     CurrentFrameSec=float(position)
-    fontsize = int(TextSizeEntry.get())
-    Width = int(WidthEntry.get())
-    Height = int(HeightEntry.get())
-    TextImageW = int(TextWidthEntry.get())
-    TextImageH = int(TextHeightEntry.get())
-    
-    MainCanvasSize = (Width, Height)
-    MainImg = Image.new('RGBA', MainCanvasSize, tuple(backgroundRGB))
-    MainDraw = ImageDraw.Draw(MainImg)
-    font = ImageFont.truetype(ttfontname, fontsize)
-    
-    TextCanvasSize= (TextImageW, TextImageH)
-    TextImg = Image.new('RGBA', TextCanvasSize, (255,255,255,0))
-    TextDraw = ImageDraw.Draw(TextImg)
-    TextDraw.text((0, 0), Lyrics[0], fill=tuple(textRGB), font=font)
-    maskBackground = (255,255,255,0)
-    MaskImg = Image.new('RGBA', TextCanvasSize, maskBackground)
-    MaskDraw = ImageDraw.Draw(MaskImg)
-    maskRGB= (0, 0, 0, 255)
-    MaskDraw.text((0, 0), Lyrics[0], fill=maskRGB, font=font)
+    PrepareCanvas(Width, Height, TextImageW, TextImageH, fontsize)
+    PrepareLyricImages()
 
     fps = 10
-    gravity=-9.8*float(GravEntry.get())
-    
+    dt = 1.0/fps
+    active = (Seconds>float(position)-5) & (Seconds<float(position)+5) & (LyricPosition[:, 1]>0)
+    idxActive = np.flatnonzero(active)
+    if(len(idxActive) == 0):
+        if(BlankPreviewKey == (CanvasKey, tuple(backgroundRGB))):
+            return
+        BlankPreviewKey = (CanvasKey, tuple(backgroundRGB))
+    else:
+        BlankPreviewKey = None
     MainDraw.rectangle((0,0, Width, Height), fill=tuple(backgroundRGB))
-    for i in range(maxNotes):
-        if((Seconds[i]>float(position)-5)*(Seconds[i]<float(position)+5)):
-            if(LyricPosition[i, 1]>0):
-                TextDraw.text((0, 0), Lyrics[i], fill=tuple(textRGB), font=font)
-                MaskDraw.text((0, 0), Lyrics[i], fill=maskRGB, font=font)
-                X = int(LyricPosition[i, 0]*Width)
-                Y = int(Height*(1 - LyricPosition[i, 1]))
-                MainImg.paste(TextImg, (X, Y, X+TextImageW, Y+TextImageH), MaskImg)
-                TextDraw.rectangle((0,0, TextImageW, TextImageH), fill=tuple(backgroundRGB))
-                MaskDraw.rectangle((0,0, TextImageW, TextImageH), fill=maskBackground)
-                LyricVelocity[i, 1] += gravity*float(1/fps)
-                LyricPosition[i, 0] += LyricVelocity[i, 0]*float(1/fps)
-                LyricPosition[i, 1] += LyricVelocity[i, 1]*float(1/fps)
-    Disp_img = MainImg.resize((int(Width/2),int(Height/2)))
-    imgtk = ImageTk.PhotoImage(image=Disp_img)
-    ImageLabel.imgtk = imgtk
-    ImageLabel.configure(image=imgtk)
+    for i in idxActive:
+        X = int(LyricPosition[i, 0]*Width)
+        Y = int(Height*(1 - LyricPosition[i, 1]))
+        TextImg, MaskImg = LyricImages[i]
+        MainImg.paste(TextImg, (X, Y, X+TextImageW, Y+TextImageH), MaskImg)
+    LyricVelocity[idxActive, 1] += gravity*dt
+    LyricPosition[idxActive] += LyricVelocity[idxActive]*dt
+    ShowPreview(MainImg)
 
 def InitializeLyricsMotion():
     global fFileLoaded
@@ -353,16 +396,14 @@ def InitializeLyricsMotion():
         print('index=%04d: %s at position (%3.2f, %3.2f) with vector (%3.2f, %3.2f)' 
               % (i, Lyrics[i], LyricPosition[i, 0], LyricPosition[i, 1], LyricVelocity[i, 0], LyricVelocity[i, 1]))
     FrameScale.set(0)
-    global CurrentFrameSec, MainDraw
+    global CurrentFrameSec, BlankPreviewKey
     CurrentFrameSec=0
     FrameScale.configure(to=float(MaxTEntry.get()))
-    Width = int(WidthEntry.get())
-    Height = int(HeightEntry.get())
+    UpdateFrameSettings()
+    PrepareCanvas(Width, Height, TextImageW, TextImageH, fontsize)
     MainDraw.rectangle((0,0, Width, Height), fill=tuple(backgroundRGB))
-    Disp_img = MainImg.resize((int(Width/2),int(Height/2)))
-    imgtk = ImageTk.PhotoImage(image=Disp_img)
-    ImageLabel.imgtk = imgtk
-    ImageLabel.configure(image=imgtk)
+    ShowPreview(MainImg)
+    BlankPreviewKey = (CanvasKey, tuple(backgroundRGB))
 ScaleReset=Tk.Button(root, text='Reset', command=InitializeLyricsMotion)
 ScaleReset.grid(row=8, column=0,sticky=Tk.W+Tk.E)
 FrameScale = Tk.Scale(root, orient='horizontal', command=ShowFrame, cursor='arrow', \
@@ -375,62 +416,75 @@ def GenerateMP4():
     if(fFileLoaded==0):
         return
     InitializeLyricsMotion()
-    global ttfontname, Lyrics, font, backgroundRGB, textRGB, InputFileName
-    fontsize = int(TextSizeEntry.get())
-    Width = int(WidthEntry.get())
-    Height = int(HeightEntry.get())
-    TextImageW = int(TextWidthEntry.get())
-    TextImageH = int(TextHeightEntry.get())
-    
-    MainCanvasSize = (Width, Height)
-    MainImg = Image.new('RGBA', MainCanvasSize, tuple(backgroundRGB))
-    MainDraw = ImageDraw.Draw(MainImg)
-    font = ImageFont.truetype(ttfontname, fontsize)
-    
-    TextCanvasSize= (TextImageW, TextImageH)
-    TextImg = Image.new('RGBA', TextCanvasSize, (255,255,255,0))
-    TextDraw = ImageDraw.Draw(TextImg)
-    TextDraw.text((0, 0), Lyrics[0], fill=tuple(textRGB), font=font)
-    maskBackground = (255,255,255,0)
-    MaskImg = Image.new('RGBA', TextCanvasSize, maskBackground)
-    MaskDraw = ImageDraw.Draw(MaskImg)
-    maskRGB= (0, 0, 0, 255)
-    MaskDraw.text((0, 0), Lyrics[0], fill=maskRGB, font=font)
+    global Lyrics, backgroundRGB, textRGB, InputFileName
+    PrepareCanvas(Width, Height, TextImageW, TextImageH, fontsize)
+    PrepareLyricImages()
+    # the Tk event loop runs between the chunks, so the renderer gets its own copy of the settings
+    RenderSettings = (CanvasKey[0:4], tuple(backgroundRGB), LyricImages)
+    FrameWidth, FrameHeight = CanvasKey[0:2]
 
     idxFrame = 0
     fps = float(FPSEntry.get())
     maxSeconds = float(MaxTEntry.get())
-    gravity=-9.8*float(GravEntry.get())
-    
-    pathParent = Path(InputFileName).parent.absolute()
+    # loop invariants of the frame loop
+    dt = float(1/fps)
+    gdt = gravity*dt
+
     MP4FileName = InputFileName.replace(".musicxml", ".mp4")
-    while(float(idxFrame/fps)<maxSeconds):
-        for i in range(maxNotes):
-            if(float(idxFrame/fps)>Seconds[i]):
-                if(LyricPosition[i, 1]>0):
-                    TextDraw.text((0, 0), Lyrics[i], fill=tuple(textRGB), font=font)
-                    MaskDraw.text((0, 0), Lyrics[i], fill=maskRGB, font=font)
-                    X = int(LyricPosition[i, 0]*Width)
-                    Y = int(Height*(1 - LyricPosition[i, 1]))
-                    MainImg.paste(TextImg, (X, Y, X+TextImageW, Y+TextImageH), MaskImg)
-                    TextDraw.rectangle((0,0, TextImageW, TextImageH), fill=tuple(backgroundRGB))
-                    MaskDraw.rectangle((0,0, TextImageW, TextImageH), fill=maskBackground)
-                    LyricVelocity[i, 1] += gravity*float(1/fps)
-                    LyricPosition[i, 0] += LyricVelocity[i, 0]*float(1/fps)
-                    LyricPosition[i, 1] += LyricVelocity[i, 1]*float(1/fps)
-        OutFileName= '%s\\temp\\LyricImage%05d.png' % (pathParent, idxFrame)
-        MainImg.save(OutFileName)
-        MainDraw.rectangle((0,0, Width, Height), fill=tuple(backgroundRGB))
-        ProgressLabel.configure(text='Progress: %d [s]' % int(idxFrame/fps))
+    # raw RGBA frames are piped to ffmpeg instead of going through temporary PNG files
+    CommandList = ['ffmpeg.exe', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '%dx%d' % (FrameWidth, FrameHeight),
+                   '-r', '%g' % fps, '-i', '-', '-c:v', 'libx264', '-preset', 'ultrafast', '-r', '30', '-pix_fmt', 'yuv420p', MP4FileName]
+    try:
+        FFmpegProcess = subprocess.Popen(CommandList, stdin=subprocess.PIPE)
+    except OSError as e:
+        print('ffmpeg could not be started: %s' % e)
+        ProgressLabel.configure(text='No ffmpeg')
         ProgressLabel.update()
+        return
+
+    # The motion is integrated frame by frame first, recording the visible
+    # lyrics and their positions, so that the frames can be rendered in parallel.
+    Frames = []
+    FrameSec = 0.0
+    while(FrameSec<maxSeconds):
+        active = (Seconds<FrameSec) & (LyricPosition[:, 1]>0)
+        idxActive = np.flatnonzero(active)
+        X = (LyricPosition[idxActive, 0]*FrameWidth).astype(np.int32)
+        Y = (FrameHeight*(1 - LyricPosition[idxActive, 1])).astype(np.int32)
+        Frames.append((idxActive.tolist(), X.tolist(), Y.tolist()))
+        LyricVelocity[idxActive, 1] += gdt
+        LyricPosition[idxActive] += LyricVelocity[idxActive]*dt
         idxFrame += 1
-    ProgressLabel.configure(text='Converting')
-    ProgressLabel.update()
-    CommandStr = 'ffmpeg.exe -y -r 30 -i %s' % pathParent + '\\temp\\LyricImage%05d.png -c:v libx265 -r 30 -pix_fmt yuv420p ' + MP4FileName
-    subprocess.call(CommandStr, shell=True)
-    CommandStr='del %s\\temp\\*.png' % pathParent
-    subprocess.call(CommandStr, shell=True)
-    ProgressLabel.configure(text='Finished')
+        FrameSec = idxFrame/fps
+
+    # frames are rendered in chunks so that only a few of them are held in memory
+    ChunkFrames = RenderThreads*2
+    try:
+        with ThreadPoolExecutor(max_workers=RenderThreads) as Executor:
+            for idxChunk in range(0, len(Frames), ChunkFrames):
+                for FrameBytes in Executor.map(partial(RenderLyricFrame, RenderSettings), Frames[idxChunk:idxChunk+ChunkFrames]):
+                    FFmpegProcess.stdin.write(FrameBytes)
+                ProgressLabel.configure(text='Progress: %d [s]' % int(idxChunk/fps))
+                ProgressLabel.update()
+        ProgressLabel.configure(text='Converting')
+        ProgressLabel.update()
+    except OSError as e:
+        # ffmpeg exited early, its own message tells why and the return code is checked below.
+        # Windows reports the closed pipe as EINVAL instead of a broken pipe, as handled in subprocess.
+        if(not isinstance(e, BrokenPipeError) and e.errno != errno.EINVAL):
+            raise
+    finally:
+        try:
+            FFmpegProcess.stdin.close()
+        except OSError as e:
+            if(not isinstance(e, BrokenPipeError) and e.errno != errno.EINVAL):
+                raise
+        FFmpegProcess.wait()
+    if(FFmpegProcess.returncode != 0):
+        print('ffmpeg failed with return code %d' % FFmpegProcess.returncode)
+        ProgressLabel.configure(text='Failed')
+    else:
+        ProgressLabel.configure(text='Finished')
     ProgressLabel.update()
 ConvertButton = Tk.Button(root, text='Generate MP4 File', height=2, command=GenerateMP4)
 ConvertButton.grid(row=10, column=0, columnspan=4, sticky=Tk.W+Tk.E)